@@ -0,0 +1,13 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5005')}"
+
+# One process on purpose: subscriptions, seen events and caches live in memory
+# in src/main.py, so extra workers would each see a different copy.
+# Concurrency comes from threads instead.
+workers = 1
+worker_class = "gthread"
+threads = 8
+
+timeout = 30
+keepalive = 75
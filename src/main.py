@@ -1,23 +1,87 @@
 import os
-import json
-from datetime import datetime
-
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import atexit
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+
+from dotenv import load_dotenv
+from flask import Flask, Response, request, jsonify
+import orjson
 import stripe
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # -----------------------------
 # CONFIG
 # -----------------------------
 
+# Deployed environments (ENV=production) already have their env set; locally
+# read config/payment.env directly instead of letting dotenv search for a .env
+DOTENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "payment.env")
+if os.getenv("ENV") != "production":
+    load_dotenv(DOTENV_PATH)
+
+# Log records go through a queue; a listener thread does the actual stderr writes
+# (no basicConfig: its default formatter on the QueueHandler would format every line twice)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+_LOG_QUEUE = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_root_logger = logging.getLogger()
+_root_logger.addHandler(QueueHandler(_LOG_QUEUE))
+_root_logger.setLevel(LOG_LEVEL)
+LOG_LISTENER = QueueListener(_LOG_QUEUE, _log_stream)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
+
+log = logging.getLogger(__name__)
+
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+_WEBHOOK_SECRET_BYTES = (STRIPE_WEBHOOK_SECRET or "").encode()
+WEBHOOK_TOLERANCE = 300  # seconds; same default as stripe-python
+MAX_WEBHOOK_BYTES = 1 << 20  # request body cap; Stripe events are far smaller, don't hash anything bigger
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 VIP_GROUP_ID = os.getenv("VIP_GROUP_ID")  # Telegram VIP group/channel id (with -100... etc)
 
+# Telegram Bot API endpoints, built once
+TELEGRAM_API_BASE = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+SEND_MESSAGE_URL = f"{TELEGRAM_API_BASE}/sendMessage"
+INVITE_URL = f"{TELEGRAM_API_BASE}/createChatInviteLink"
+REVOKE_INVITE_URL = f"{TELEGRAM_API_BASE}/revokeChatInviteLink"
+
+# member_limit = 1  => only one person can join with this link
+INVITE_LINK_PAYLOAD = {
+    "chat_id": VIP_GROUP_ID,
+    "member_limit": 1,
+    "creates_join_request": False,
+}
+
+PAYMENT_CONFIRMED_TEMPLATE = (
+    "🎉 Payment Confirmed!\n\n"
+    "Welcome to ZoneFlow FX VIP!\n\n"
+    "Plan: {plan}\n\n"
+    "Here is your private VIP group link:\n"
+    "{invite_link}\n\n"
+    "If you have any problem joining, reply to this message. 🚀"
+)
+PAYMENT_CONFIRMED_NO_LINK_TEXT = (
+    "🎉 Payment Confirmed!\n\n"
+    "Welcome to ZoneFlow FX VIP!\n\n"
+    "We could not generate an automatic invite link.\n"
+    "Please contact support so we can manually add you. 🙏"
+)
+
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+_ADMIN_KEY_BYTES = ADMIN_API_KEY.encode()
 ADMIN_USER_ID = os.getenv("ADMIN_USER_ID")
 
 # Price IDs
@@ -25,6 +89,22 @@ PRICE_ID_MONTHLY = os.getenv("PRICE_ID_MONTHLY")
 PRICE_ID_QUARTERLY = os.getenv("PRICE_ID_QUARTERLY")
 PRICE_ID_YEARLY = os.getenv("PRICE_ID_YEARLY")
 
+# Where Stripe Checkout sends the user back to
+CHECKOUT_SUCCESS_URL = "https://t.me/ZoneFlowFXBot?start=success"
+CHECKOUT_CANCEL_URL = "https://t.me/ZoneFlowFXBot?start=cancel"
+
+# Same user + plan within this window reuses one Checkout Session (Stripe idempotency)
+CHECKOUT_IDEMPOTENCY_WINDOW = 600  # seconds
+
+# Only the checkout endpoint is called from browsers; it gets fixed CORS headers
+CHECKOUT_ALLOWED_ORIGIN = os.getenv("CHECKOUT_ALLOWED_ORIGIN") or "*"
+CHECKOUT_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": CHECKOUT_ALLOWED_ORIGIN,
+    "Access-Control-Allow-Methods": "POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Vary": "Origin",
+}
+
 # Map our plan keys to Stripe price IDs
 PLAN_PRICE_MAP = {
     "monthly": PRICE_ID_MONTHLY,
@@ -35,12 +115,70 @@ PLAN_PRICE_MAP = {
 # In-memory subscription store (keyed by telegram_user_id as string)
 SUBSCRIPTIONS = {}
 
+# Shared HTTP session for Telegram calls so connections (and TLS) are reused.
+# The adapter only covers api.telegram.org so its pool is never shared with Stripe.
+TG_SESSION = requests.Session()
+TG_SESSION.mount("https://api.telegram.org/", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    # Connection errors and Telegram 5xx with plain backoff. 429 is retried in
+    # telegram_post, which caps the wait and goes back through the rate limiter.
+    # read=0: once a POST has gone out, a lost response is not retried, since
+    # Telegram may have acted on it (duplicate DM / an extra unheld invite link).
+    max_retries=Retry(
+        total=3,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    ),
+))
+
+# Stripe API calls get their own session/pool (stripe-python does its own retries)
+STRIPE_SESSION = requests.Session()
+STRIPE_SESSION.mount("https://api.stripe.com/", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+stripe.default_http_client = stripe.RequestsClient(session=STRIPE_SESSION)
+
+# Recently seen Stripe event ids -> time first seen (epoch), oldest first
+SEEN_EVENTS = OrderedDict()
+SEEN_EVENTS_LOCK = threading.Lock()
+SEEN_EVENTS_MAX = 10_000
+SEEN_EVENTS_TTL = 3600  # seconds
+
+# Ready-made single-use VIP invite links as (expire_date epoch, link), oldest first.
+# Topped up in the background once the first payment needs a link.
+INVITE_POOL = deque(maxlen=50)
+INVITE_POOL_LOCK = threading.Lock()
+INVITE_POOL_TARGET = 20
+INVITE_POOL_LOW = 5
+INVITE_POOL_LINK_TTL = 7 * 24 * 3600  # pooled links expire on Telegram's side after this
+INVITE_POOL_MIN_REMAINING = 24 * 3600  # never hand out a link with less time left
+_invite_pool_started = False
+INVITE_POOL_STOP = threading.Event()  # set at exit; the filler stops adding links
+
+# Short-lived cache of Stripe subscriptions: id -> (monotonic fetch time, subscription)
+SUB_CACHE = {}
+SUB_CACHE_LOCK = threading.Lock()
+SUB_CACHE_MAX = 1000
+SUB_CACHE_TTL = 60  # seconds
+
 # -----------------------------
 # FLASK APP
 # -----------------------------
 
 app = Flask(__name__)
-CORS(app)
+app.config["MAX_CONTENT_LENGTH"] = MAX_WEBHOOK_BYTES
+
+
+@app.after_request
+def add_checkout_cors_headers(resp):
+    # Webhook/admin traffic is server-to-server and needs no CORS
+    if request.endpoint != "create_checkout_session":
+        return resp
+    resp.headers.update(CHECKOUT_CORS_HEADERS)
+    return resp
 
 
 @app.route("/", methods=["GET"])
@@ -52,60 +190,191 @@ def health():
 # HELPERS
 # -----------------------------
 
-def create_single_use_invite_link() -> str | None:
+class TokenBucket:
+    """
+    Blocking token bucket: acquire() waits until a token is available.
+    rate = tokens added per second, burst = bucket size.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+# Stay under Telegram's ~30 requests/second global bot limit
+TG_RATE_LIMITER = TokenBucket(rate=25, burst=30)
+
+# 429 handling in telegram_post: retries, and the longest flood-wait we'll sleep through
+TG_429_RETRIES = 2
+TG_RETRY_AFTER_MAX = 30  # seconds
+
+
+def _telegram_retry_after(resp: requests.Response) -> int:
+    try:
+        return int(resp.json().get("parameters", {}).get("retry_after"))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return 1
+
+
+def telegram_post(url: str, payload: dict) -> requests.Response:
+    """
+    POST to the Telegram Bot API through the shared session and rate limiter.
+    On 429 waits out Telegram's retry_after (if at most TG_RETRY_AFTER_MAX)
+    and retries, taking a fresh rate-limiter token each time.
+    5xx/connection retries happen in TG_SESSION's adapter.
+    """
+    for attempt in range(TG_429_RETRIES + 1):
+        TG_RATE_LIMITER.acquire()
+        resp = TG_SESSION.post(url, json=payload, timeout=10)
+        if resp.status_code != 429:
+            return resp
+
+        retry_after = _telegram_retry_after(resp)
+        if attempt == TG_429_RETRIES or retry_after > TG_RETRY_AFTER_MAX:
+            log.warning("Telegram rate limited (retry_after=%ss); giving up", retry_after)
+            return resp
+        log.warning("Telegram rate limited; retrying in %ss", retry_after)
+        time.sleep(retry_after)
+
+    return resp
+
+
+def create_single_use_invite_link(expire_date: int | None = None) -> str | None:
     """
     Asks Telegram to create a one-time invite link for the VIP group.
     member_limit = 1  => only one person can join with this link
+    expire_date (epoch) makes Telegram invalidate the link by itself.
     """
     if not TELEGRAM_BOT_TOKEN or not VIP_GROUP_ID:
-        print("Telegram token or VIP_GROUP_ID not set.")
+        log.warning("Telegram token or VIP_GROUP_ID not set.")
         return None
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/createChatInviteLink"
-    payload = {
-        "chat_id": VIP_GROUP_ID,
-        "member_limit": 1,
-        "creates_join_request": False,
-    }
+    payload = INVITE_LINK_PAYLOAD
+    if expire_date:
+        payload = {**INVITE_LINK_PAYLOAD, "expire_date": expire_date}
 
     try:
-        resp = requests.post(url, json=payload, timeout=10)
+        resp = telegram_post(INVITE_URL, payload)
         data = resp.json()
         if not data.get("ok"):
-            print("Failed to create invite link:", data)
+            log.error("Failed to create invite link: %s", data)
             return None
         return data["result"]["invite_link"]
     except Exception as e:
-        print("Error calling Telegram API:", e)
+        log.error("Error calling Telegram API: %s", e)
         return None
 
 
+def get_vip_invite_link() -> str | None:
+    """
+    Takes a pre-created invite link from the pool, falling back to
+    creating one on the spot if the pool is empty. The first call starts
+    the background filler, so importing this module makes no Telegram calls.
+    """
+    _start_invite_pool()
+
+    min_expiry = time.time() + INVITE_POOL_MIN_REMAINING
+    with INVITE_POOL_LOCK:
+        # Oldest links are at the front; drop any too close to expiring
+        while INVITE_POOL and INVITE_POOL[0][0] < min_expiry:
+            INVITE_POOL.popleft()
+        if INVITE_POOL:
+            return INVITE_POOL.popleft()[1]
+    return create_single_use_invite_link()
+
+
+def _start_invite_pool():
+    global _invite_pool_started
+    if not TELEGRAM_BOT_TOKEN or not VIP_GROUP_ID:
+        return
+    with INVITE_POOL_LOCK:
+        if _invite_pool_started:
+            return
+        _invite_pool_started = True
+    threading.Thread(target=_invite_pool_filler, name="invite-pool", daemon=True).start()
+    atexit.register(_revoke_invite_pool)
+
+
+def _invite_pool_filler():
+    while not INVITE_POOL_STOP.is_set():
+        with INVITE_POOL_LOCK:
+            size = len(INVITE_POOL)
+
+        if size >= INVITE_POOL_LOW:
+            INVITE_POOL_STOP.wait(1)
+            continue
+
+        # Top up to the target at ~1 link/sec to stay well inside Telegram limits
+        while size < INVITE_POOL_TARGET and not INVITE_POOL_STOP.is_set():
+            expire_date = int(time.time()) + INVITE_POOL_LINK_TTL
+            link = create_single_use_invite_link(expire_date)
+            if not link:
+                INVITE_POOL_STOP.wait(30)
+                break
+            with INVITE_POOL_LOCK:
+                stopped = INVITE_POOL_STOP.is_set()
+                if not stopped:
+                    INVITE_POOL.append((expire_date, link))
+                    size = len(INVITE_POOL)
+            if stopped:
+                # Pool was already revoked while this link was being created
+                _revoke_invite_link(link)
+                return
+            INVITE_POOL_STOP.wait(1)
+
+
+def _revoke_invite_link(link: str):
+    try:
+        telegram_post(REVOKE_INVITE_URL, {"chat_id": VIP_GROUP_ID, "invite_link": link})
+    except Exception as e:
+        log.error("Error revoking pooled invite link: %s", e)
+
+
+def _revoke_invite_pool():
+    """
+    Revokes links still sitting in the pool at shutdown so they don't stay
+    usable until they expire. expire_date covers the case where this never runs.
+    """
+    with INVITE_POOL_LOCK:
+        # Under the lock, so the filler can't append after the pool is emptied
+        INVITE_POOL_STOP.set()
+        links = [link for _, link in INVITE_POOL]
+        INVITE_POOL.clear()
+
+    for link in links:
+        _revoke_invite_link(link)
+
+
 def send_payment_confirmed_message(telegram_user_id: int, plan: str, invite_link: str | None):
     """
     Sends a DM to the user from your bot with the VIP invite link.
     """
     if not TELEGRAM_BOT_TOKEN:
-        print("TELEGRAM_BOT_TOKEN not configured; cannot send message.")
+        log.warning("TELEGRAM_BOT_TOKEN not configured; cannot send message.")
         return
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-
     if invite_link:
-        text = (
-            "🎉 Payment Confirmed!\n\n"
-            "Welcome to ZoneFlow FX VIP!\n\n"
-            f"Plan: {plan}\n\n"
-            "Here is your private VIP group link:\n"
-            f"{invite_link}\n\n"
-            "If you have any problem joining, reply to this message. 🚀"
-        )
+        text = PAYMENT_CONFIRMED_TEMPLATE.format(plan=plan, invite_link=invite_link)
     else:
-        text = (
-            "🎉 Payment Confirmed!\n\n"
-            "Welcome to ZoneFlow FX VIP!\n\n"
-            "We could not generate an automatic invite link.\n"
-            "Please contact support so we can manually add you. 🙏"
-        )
+        text = PAYMENT_CONFIRMED_NO_LINK_TEXT
 
     payload = {
         "chat_id": telegram_user_id,
@@ -113,11 +382,11 @@ def send_payment_confirmed_message(telegram_user_id: int, plan: str, invite_link
     }
 
     try:
-        r = requests.post(url, json=payload, timeout=10)
+        r = telegram_post(SEND_MESSAGE_URL, payload)
         if not r.ok:
-            print("Failed to send Telegram message:", r.text)
+            log.error("Failed to send Telegram message: %s", r.text)
     except Exception as e:
-        print("Error sending Telegram message:", e)
+        log.error("Error sending Telegram message: %s", e)
 
 
 def record_subscription(telegram_user_id: int, plan: str, status: str, current_period_end: int | None):
@@ -132,6 +401,87 @@ def record_subscription(telegram_user_id: int, plan: str, status: str, current_p
     }
 
 
+def is_duplicate_event(event_id: str) -> bool:
+    """
+    Returns True if this Stripe event id was already seen recently.
+    Stripe redelivers events, so duplicates are dropped before any work.
+    Also used with "invoice:<id>" keys so overlapping events for one invoice
+    only notify once.
+    """
+    now = time.time()
+    with SEEN_EVENTS_LOCK:
+        if event_id in SEEN_EVENTS:
+            return True
+
+        SEEN_EVENTS[event_id] = now
+
+        # Evict by size, then anything older than the TTL
+        while len(SEEN_EVENTS) > SEEN_EVENTS_MAX:
+            SEEN_EVENTS.popitem(last=False)
+        while SEEN_EVENTS and next(iter(SEEN_EVENTS.values())) < now - SEEN_EVENTS_TTL:
+            SEEN_EVENTS.popitem(last=False)
+
+    return False
+
+
+def verify_stripe_signature(payload: bytes, sig_header: str) -> bool:
+    """
+    Checks a Stripe-Signature header ("t=...,v1=...[,v1=...]") against the
+    raw body, the same way stripe.Webhook.construct_event does, but with the
+    secret pre-encoded and without building a StripeObject afterwards.
+    """
+    timestamp = None
+    signatures = []
+    for item in sig_header.split(","):
+        key, _, value = item.partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+
+    if timestamp is None or not signatures:
+        return False
+    try:
+        ts = int(timestamp)
+    except ValueError:
+        return False
+
+    # Compare as bytes: compare_digest raises TypeError on non-ASCII str input
+    expected = hmac.new(_WEBHOOK_SECRET_BYTES, b"%d." % ts + payload, hashlib.sha256).hexdigest().encode()
+    if not any(hmac.compare_digest(expected, sig.encode("utf-8", "surrogateescape")) for sig in signatures):
+        return False
+
+    # Reject replays of old (but validly signed) deliveries
+    return ts >= time.time() - WEBHOOK_TOLERANCE
+
+
+def get_subscription(subscription_id: str):
+    """
+    stripe.Subscription.retrieve with a small TTL cache, so back-to-back
+    events for the same subscription cost one Stripe round trip.
+    """
+    now = time.monotonic()
+    with SUB_CACHE_LOCK:
+        cached = SUB_CACHE.get(subscription_id)
+        if cached and now - cached[0] < SUB_CACHE_TTL:
+            return cached[1]
+
+    subscription = stripe.Subscription.retrieve(subscription_id)
+
+    with SUB_CACHE_LOCK:
+        SUB_CACHE.pop(subscription_id, None)
+        SUB_CACHE[subscription_id] = (now, subscription)
+        while len(SUB_CACHE) > SUB_CACHE_MAX:
+            SUB_CACHE.pop(next(iter(SUB_CACHE)))
+
+    return subscription
+
+
+def invalidate_subscription(subscription_id: str):
+    with SUB_CACHE_LOCK:
+        SUB_CACHE.pop(subscription_id, None)
+
+
 # -----------------------------
 # CREATE CHECKOUT SESSION
 # -----------------------------
@@ -154,12 +504,18 @@ def create_checkout_session():
     if not price_id:
         return jsonify({"error": f"Invalid plan '{plan}'"}), 400
 
+    # Double-clicks / client retries get the same session back from Stripe
+    idempotency_key = hashlib.sha256(
+        f"{telegram_user_id}|{plan}|{int(time.time() // CHECKOUT_IDEMPOTENCY_WINDOW)}".encode()
+    ).hexdigest()
+
     try:
         session = stripe.checkout.Session.create(
+            idempotency_key=idempotency_key,
             mode="subscription",
             line_items=[{"price": price_id, "quantity": 1}],
-            success_url="https://t.me/ZoneFlowFXBot?start=success",
-            cancel_url="https://t.me/ZoneFlowFXBot?start=cancel",
+            success_url=CHECKOUT_SUCCESS_URL,
+            cancel_url=CHECKOUT_CANCEL_URL,
             metadata={
                 "telegram_user_id": str(telegram_user_id),
                 "plan": plan,
@@ -172,7 +528,7 @@ def create_checkout_session():
             },
         )
     except Exception as e:
-        print("Error creating checkout session:", e)
+        log.error("Error creating checkout session: %s", e)
         return jsonify({"error": str(e)}), 500
 
     return jsonify({"checkout_url": session.url}), 200
@@ -182,71 +538,134 @@ def create_checkout_session():
 # STRIPE WEBHOOK
 # -----------------------------
 
+def _on_invoice_paid(obj):
+    # Both invoice events can arrive for the same payment; handle it once
+    invoice_id = obj.get("id")
+    if invoice_id and is_duplicate_event(f"invoice:{invoice_id}"):
+        log.info("Invoice %s already handled; skipping", invoice_id)
+        return
+
+    try:
+        # Get subscription and metadata
+        subscription_id = obj.get("subscription")
+        if subscription_id:
+            subscription = get_subscription(subscription_id)
+            metadata = subscription.metadata or {}
+        else:
+            metadata = obj.get("metadata", {})
+
+        telegram_user_id = metadata.get("telegram_user_id")
+        plan = metadata.get("plan", "unknown")
+
+        if telegram_user_id:
+            telegram_user_id_int = int(telegram_user_id)
+
+            # Current period end (epoch)
+            current_period_end = None
+            if subscription_id:
+                cpe = getattr(subscription, "current_period_end", None)
+                if cpe:
+                    current_period_end = int(cpe)
+
+            # Record in our in-memory dict
+            record_subscription(
+                telegram_user_id_int,
+                plan,
+                status="active",
+                current_period_end=current_period_end,
+            )
+
+            # Single-use invite link (from the pool when possible)
+            invite_link = get_vip_invite_link()
+
+            # Send Telegram DM
+            send_payment_confirmed_message(
+                telegram_user_id_int,
+                plan,
+                invite_link,
+            )
+
+    except Exception as e:
+        log.exception("Error handling invoice.payment_succeeded: %s", e)
+
+
+def _on_subscription_changed(obj):
+    # Subscription changed on Stripe's side; drop any cached copy
+    invalidate_subscription(obj.get("id"))
+
+
+# Stripe event type -> handler. The dashboard endpoint should subscribe to only these.
+EVENT_HANDLERS = {
+    # We care most about invoice payment success (subscription active)
+    "invoice.payment_succeeded": _on_invoice_paid,
+    "invoice.paid": _on_invoice_paid,
+    "customer.subscription.updated": _on_subscription_changed,
+    "customer.subscription.deleted": _on_subscription_changed,
+}
+
+
+def handle_event(event_type: str, obj):
+    """
+    Does the slow part of webhook processing (Stripe + Telegram calls).
+    Runs on the EXECUTOR worker threads, never inside the request.
+    """
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler:
+        handler(obj)
+
+
+# Verified events are processed here, off the request thread. Trade-off: once
+# Stripe has its 200, a failure in handle_event is only logged, never retried.
+EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="webhook-worker")
+
+
+def _run_event(event_type: str, obj):
+    try:
+        handle_event(event_type, obj)
+    except Exception as e:
+        log.exception("Error in webhook worker: %s", e)
+
+
 @app.route("/stripe-webhook", methods=["POST"])
 def stripe_webhook():
-    payload = request.data
+    if not STRIPE_WEBHOOK_SECRET:
+        log.error("STRIPE_WEBHOOK_SECRET not configured; cannot verify webhook.")
+        return "Webhook not configured", 500
+
+    # A Content-Length over MAX_CONTENT_LENGTH is rejected with 413 by Werkzeug,
+    # but a chunked body is silently truncated at the limit, so check the length too.
+    # cache=False: we only need the bytes once, for verification.
+    payload = request.get_data(cache=False)
+    if len(payload) >= MAX_WEBHOOK_BYTES:
+        return "Payload too large", 413
+
     sig_header = request.headers.get("Stripe-Signature", "")
 
+    if not verify_stripe_signature(payload, sig_header):
+        log.warning("Webhook error: invalid Stripe-Signature")
+        return "Bad signature", 400
+
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, STRIPE_WEBHOOK_SECRET
-        )
-    except Exception as e:
-        print("⚠️  Webhook error:", e)
+        event = orjson.loads(payload)
+    except orjson.JSONDecodeError as e:
+        log.warning("Webhook error: %s", e)
         return "Bad payload", 400
 
     event_type = event["type"]
     obj = event["data"]["object"]
 
     # For logging
-    print("🔔 Received event:", event_type)
+    log.info("Received event: %s", event_type)
 
-    # We care most about invoice payment success (subscription active)
-    if event_type in ("invoice.payment_succeeded", "invoice.payment_paid"):
-        try:
-            # Get subscription and metadata
-            subscription_id = obj.get("subscription")
-            if subscription_id:
-                subscription = stripe.Subscription.retrieve(subscription_id)
-                metadata = subscription.metadata or {}
-            else:
-                metadata = obj.get("metadata", {})
-
-            telegram_user_id = metadata.get("telegram_user_id")
-            plan = metadata.get("plan", "unknown")
-
-            if telegram_user_id:
-                telegram_user_id_int = int(telegram_user_id)
-
-                # Current period end (epoch)
-                current_period_end = None
-                if subscription_id:
-                    cpe = getattr(subscription, "current_period_end", None)
-                    if cpe:
-                        current_period_end = int(cpe)
-
-                # Record in our in-memory dict
-                record_subscription(
-                    telegram_user_id_int,
-                    plan,
-                    status="active",
-                    current_period_end=current_period_end,
-                )
-
-                # Create single-use invite link
-                invite_link = create_single_use_invite_link()
-
-                # Send Telegram DM
-                send_payment_confirmed_message(
-                    telegram_user_id_int,
-                    plan,
-                    invite_link,
-                )
-
-        except Exception as e:
-            print("Error handling invoice.payment_succeeded:", e)
-
-    # You can add more handlers for subscription updates or cancellations if needed.
+    if event_type not in EVENT_HANDLERS:
+        return "OK", 200
+
+    if is_duplicate_event(event["id"]):
+        log.info("Skipping duplicate event: %s", event["id"])
+        return "OK", 200
+
+    # Acknowledge straight away; Stripe retries if we're slow to answer
+    EXECUTOR.submit(_run_event, event_type, obj)
 
     return "OK", 200
 
@@ -256,15 +675,37 @@ def stripe_webhook():
 # -----------------------------
 
 def _check_admin_auth(req) -> bool:
-    header_key = req.headers.get("X-Admin-Key", "")
-    return header_key == ADMIN_API_KEY and ADMIN_API_KEY
+    # No key configured => admin endpoints stay closed
+    if not _ADMIN_KEY_BYTES:
+        return False
+    header_key = req.headers.get("X-Admin-Key", "").encode()
+    return hmac.compare_digest(header_key, _ADMIN_KEY_BYTES)
 
 
 @app.route("/admin/subscriptions", methods=["GET"])
 def admin_subscriptions():
     if not _check_admin_auth(request):
         return jsonify({"error": "unauthorised"}), 401
-    return jsonify(SUBSCRIPTIONS), 200
+    return Response(orjson.dumps(SUBSCRIPTIONS), status=200, mimetype="application/json")
+
+
+@app.route("/admin/subscriptions.ndjson", methods=["GET"])
+def admin_subscriptions_ndjson():
+    """
+    Same data as /admin/subscriptions, streamed one JSON object per line
+    so only one row is serialised at a time.
+    """
+    if not _check_admin_auth(request):
+        return jsonify({"error": "unauthorised"}), 401
+
+    # Snapshot the keys/values (not a deep copy) so the worker can keep writing
+    rows = list(SUBSCRIPTIONS.items())
+
+    def generate():
+        for telegram_id, info in rows:
+            yield orjson.dumps({"telegram_user_id": telegram_id, **info}) + b"\n"
+
+    return Response(generate(), status=200, mimetype="application/x-ndjson")
 
 
 @app.route("/admin/subscription/<telegram_id>", methods=["GET"])
@@ -283,6 +724,7 @@ def admin_subscription(telegram_id):
 # ENTRY POINT
 # -----------------------------
 
+# Local development only; deploy with: gunicorn -c gunicorn.conf.py src.main:app
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5005"))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from src import main
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+    subscription = SimpleNamespace(
+        metadata={"telegram_user_id": "654321", "plan": "monthly"},
+        current_period_end=1_900_000_000,
+    )
+
+    monkeypatch.setattr(main, "SEEN_EVENTS", OrderedDict())
+    monkeypatch.setattr(main, "SUBSCRIPTIONS", {})
+    monkeypatch.setattr(main, "get_subscription", lambda sid: subscription)
+    monkeypatch.setattr(main, "get_vip_invite_link", lambda: "https://t.me/+invite")
+    monkeypatch.setattr(
+        main,
+        "send_payment_confirmed_message",
+        lambda user_id, plan, link: messages.append((user_id, plan, link)),
+    )
+    return messages
+
+
+def test_invoice_paid_and_payment_succeeded_notify_once(sent):
+    invoice = {"id": "in_123", "subscription": "sub_123"}
+
+    main.handle_event("invoice.paid", invoice)
+    main.handle_event("invoice.payment_succeeded", invoice)
+
+    assert sent == [(654321, "monthly", "https://t.me/+invite")]
+    assert main.SUBSCRIPTIONS["654321"]["status"] == "active"
+
+
+def test_separate_invoices_each_notify(sent):
+    main.handle_event("invoice.paid", {"id": "in_1", "subscription": "sub_123"})
+    main.handle_event("invoice.paid", {"id": "in_2", "subscription": "sub_123"})
+
+    assert len(sent) == 2
+
+
+def test_unhandled_event_type_is_ignored(sent):
+    assert "invoice.payment_paid" not in main.EVENT_HANDLERS
+
+    main.handle_event("invoice.payment_paid", {"id": "in_123", "subscription": "sub_123"})
+
+    assert sent == []
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from src import main
+
+# The fixture stubs the filler out; keep the real one for the shutdown-race test
+REAL_FILLER = main._invite_pool_filler
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Fresh invite-pool state with Telegram stubbed out."""
+    state = SimpleNamespace(created=[], revoked=[], filler_starts=0, atexit=[])
+
+    def fake_create(expire_date=None):
+        state.created.append(expire_date)
+        return "inline"
+
+    def fake_telegram_post(url, payload):
+        assert url == main.REVOKE_INVITE_URL
+        state.revoked.append(payload["invite_link"])
+
+    def fake_filler():
+        state.filler_starts += 1
+
+    monkeypatch.setattr(main, "TELEGRAM_BOT_TOKEN", "token")
+    monkeypatch.setattr(main, "VIP_GROUP_ID", "-100123")
+    monkeypatch.setattr(main, "INVITE_POOL", deque(maxlen=50))
+    monkeypatch.setattr(main, "INVITE_POOL_STOP", threading.Event())
+    monkeypatch.setattr(main, "_invite_pool_started", False)
+    monkeypatch.setattr(main, "create_single_use_invite_link", fake_create)
+    monkeypatch.setattr(main, "telegram_post", fake_telegram_post)
+    monkeypatch.setattr(main, "_invite_pool_filler", fake_filler)
+    monkeypatch.setattr(main, "atexit", SimpleNamespace(register=state.atexit.append))
+    return state
+
+
+def expiring_in(seconds):
+    return int(time.time()) + seconds
+
+
+def test_link_close_to_expiry_is_never_returned(pool):
+    main.INVITE_POOL.extend([
+        (expiring_in(main.INVITE_POOL_MIN_REMAINING - 60), "stale"),
+        (expiring_in(main.INVITE_POOL_LINK_TTL), "fresh"),
+    ])
+
+    assert main.get_vip_invite_link() == "fresh"
+    assert not main.INVITE_POOL
+
+
+def test_only_stale_links_fall_back_to_inline_creation(pool):
+    main.INVITE_POOL.append((expiring_in(main.INVITE_POOL_MIN_REMAINING - 60), "stale"))
+
+    assert main.get_vip_invite_link() == "inline"
+    assert not main.INVITE_POOL
+
+
+def test_empty_pool_creates_link_inline(pool):
+    assert main.get_vip_invite_link() == "inline"
+    assert pool.created == [None]  # inline links don't get the pool's expire_date
+
+
+def test_filler_starts_only_once(pool):
+    for _ in range(3):
+        main.get_vip_invite_link()
+
+    # Thread start is asynchronous; give the recorder a moment
+    deadline = time.time() + 2
+    while pool.filler_starts < 1 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert pool.filler_starts == 1
+    assert pool.atexit == [main._revoke_invite_pool]
+
+
+def test_filler_not_started_without_telegram_config(pool, monkeypatch):
+    monkeypatch.setattr(main, "TELEGRAM_BOT_TOKEN", None)
+
+    main.get_vip_invite_link()
+
+    assert not main._invite_pool_started
+    assert pool.atexit == []
+
+
+def test_revoke_invite_pool_revokes_every_pooled_link(pool):
+    main.INVITE_POOL.extend((expiring_in(main.INVITE_POOL_LINK_TTL), f"L{i}") for i in range(3))
+
+    main._revoke_invite_pool()
+
+    assert pool.revoked == ["L0", "L1", "L2"]
+    assert not main.INVITE_POOL
+    assert main.INVITE_POOL_STOP.is_set()
+
+
+def test_link_created_during_shutdown_is_revoked_not_pooled(pool, monkeypatch):
+    def create_while_shutting_down(expire_date=None):
+        # Exit handler runs while the filler is waiting on Telegram
+        main._revoke_invite_pool()
+        return "late"
+
+    monkeypatch.setattr(main, "create_single_use_invite_link", create_while_shutting_down)
+
+    filler = threading.Thread(target=REAL_FILLER, daemon=True)
+    filler.start()
+    filler.join(timeout=5)
+
+    assert not filler.is_alive()
+    assert not main.INVITE_POOL
+    assert pool.revoked == ["late"]
@@ -0,0 +1,79 @@
+import pytest
+
+from src import main
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body or {}
+        self.headers = headers or {}
+
+    def json(self):
+        return self._body
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    responses = []
+    sleeps = []
+    limiter = CountingLimiter()
+
+    monkeypatch.setattr(main, "TG_RATE_LIMITER", limiter)
+    monkeypatch.setattr(main.TG_SESSION, "post", lambda url, json, timeout: responses.pop(0))
+    monkeypatch.setattr(main.time, "sleep", sleeps.append)
+    return responses, sleeps, limiter
+
+
+def rate_limited(retry_after):
+    return FakeResponse(429, {"ok": False, "parameters": {"retry_after": retry_after}})
+
+
+def test_429_waits_and_retries_through_rate_limiter(telegram):
+    responses, sleeps, limiter = telegram
+    responses += [rate_limited(2), FakeResponse(200, {"ok": True})]
+
+    resp = main.telegram_post("https://api.telegram.org/botX/sendMessage", {})
+
+    assert resp.status_code == 200
+    assert sleeps == [2]
+    assert limiter.acquired == 2
+
+
+def test_429_with_long_retry_after_is_not_waited_out(telegram):
+    responses, sleeps, limiter = telegram
+    responses += [rate_limited(main.TG_RETRY_AFTER_MAX + 1)]
+
+    resp = main.telegram_post("https://api.telegram.org/botX/sendMessage", {})
+
+    assert resp.status_code == 429
+    assert sleeps == []
+    assert limiter.acquired == 1
+
+
+def test_429_retries_are_bounded(telegram):
+    responses, sleeps, limiter = telegram
+    responses += [rate_limited(1) for _ in range(main.TG_429_RETRIES + 1)]
+
+    resp = main.telegram_post("https://api.telegram.org/botX/sendMessage", {})
+
+    assert resp.status_code == 429
+    assert sleeps == [1] * main.TG_429_RETRIES
+    assert limiter.acquired == main.TG_429_RETRIES + 1
+
+
+def test_429_falls_back_to_retry_after_header(telegram):
+    responses, sleeps, _ = telegram
+    responses += [FakeResponse(429, {"ok": False}, {"Retry-After": "3"}), FakeResponse(200)]
+
+    main.telegram_post("https://api.telegram.org/botX/sendMessage", {})
+
+    assert sleeps == [3]
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+import stripe
+
+from src import main
+
+SECRET = "whsec_test_secret"
+PAYLOAD = '{"id":"evt_test","type":"ping.test","data":{"object":{}}}'
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(main, "_WEBHOOK_SECRET_BYTES", SECRET.encode())
+
+
+def stripe_header(payload=PAYLOAD, secret=SECRET, timestamp=None):
+    return stripe.WebhookSignature.generate_signature_header(payload, secret, timestamp=timestamp)
+
+
+def stripe_accepts(payload, header):
+    try:
+        stripe.Webhook.construct_event(payload, header, SECRET)
+        return True
+    # stripe-python raises TypeError on a non-ASCII v1 rather than rejecting it
+    except (stripe.SignatureVerificationError, ValueError, TypeError):
+        return False
+
+
+def _v1(header):
+    return header.split("v1=", 1)[1]
+
+
+@pytest.mark.parametrize(
+    "payload, header, expected",
+    [
+        pytest.param(PAYLOAD, stripe_header(), True, id="valid"),
+        pytest.param(PAYLOAD + " ", stripe_header(), False, id="tampered-payload"),
+        pytest.param(PAYLOAD, stripe_header(secret="whsec_other"), False, id="wrong-secret"),
+        pytest.param(PAYLOAD, stripe_header(timestamp=int(time.time()) - 400), False, id="stale"),
+        pytest.param(PAYLOAD, f"t={int(time.time())},v1=deadbeef,v1={_v1(stripe_header())}", True, id="second-v1-matches"),
+        pytest.param(PAYLOAD, f"t={int(time.time())},v0={_v1(stripe_header())}", False, id="only-v0-scheme"),
+        pytest.param(PAYLOAD, f"v1={_v1(stripe_header())}", False, id="missing-t"),
+        pytest.param(PAYLOAD, f"t={int(time.time())}", False, id="missing-v1"),
+        pytest.param(PAYLOAD, f"t=abc,v1={_v1(stripe_header())}", False, id="non-integer-t"),
+        pytest.param(PAYLOAD, "", False, id="empty-header"),
+        pytest.param(PAYLOAD, f"t={int(time.time())},v1=\u00e9abc", False, id="non-ascii-v1"),
+    ],
+)
+def test_verify_stripe_signature_matches_stripe(payload, header, expected):
+    assert main.verify_stripe_signature(payload.encode(), header) is expected
+    assert stripe_accepts(payload, header) is expected
+
+
+def test_webhook_endpoint_checks_signature():
+    client = main.app.test_client()
+
+    ok = client.post("/stripe-webhook", data=PAYLOAD, headers={"Stripe-Signature": stripe_header()})
+    assert ok.status_code == 200
+
+    bad = client.post("/stripe-webhook", data=PAYLOAD + " ", headers={"Stripe-Signature": stripe_header()})
+    assert bad.status_code == 400
+
+
+def test_webhook_endpoint_rejects_non_ascii_signature():
+    client = main.app.test_client()
+
+    resp = client.post(
+        "/stripe-webhook",
+        data=PAYLOAD,
+        headers={"Stripe-Signature": f"t={int(time.time())},v1=\u00e9abc"},
+    )
+    assert resp.status_code == 400